@@ -1,11 +1,23 @@
 import sys
+import time
+import queue
+import bisect
+import calendar
+import random
 import socket
+import struct
+import logging
 import sqlite3
+import argparse
+import threading
+import ipaddress
+import collections
+import socketserver
 import pandas as pd
 import subprocess
 import platform
 import webbrowser
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton,
@@ -13,10 +25,12 @@ from PyQt5.QtWidgets import (
     QLabel, QSpinBox, QMessageBox, QProgressBar,
     QHBoxLayout, QDialog, QDateTimeEdit, QHeaderView,
     QAbstractItemView, QLineEdit, QMenu, QFormLayout,
-    QTableView, QCheckBox
+    QTableView, QCheckBox, QComboBox
 )
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer
-from PyQt5.QtGui import QColor
+from PyQt5.QtCore import (
+    QThread, pyqtSignal, Qt, QTimer, QAbstractTableModel, QModelIndex, QRect, QRectF, QPointF
+)
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
 
 # تلاش برای ایمپورت pyodbc برای اس‌کیو‌ال سرور
 try:
@@ -27,18 +41,20 @@ except ImportError:
 
 DB_NAME = "devices.db"
 
+log = logging.getLogger("device-monitor")
+
 # --- استایل نهایی و حرفه‌ای ---
 MODERN_STYLE = """
     QWidget { background-color: #0F111A; color: #E0E0E0; font-family: 'Segoe UI'; font-size: 13px; }
-    QTableWidget { 
+    QTableView { 
         background-color: #161925; 
         alternate-background-color: #1C2030; 
         border: 1px solid #2D3245; 
         gridline-color: transparent; 
         outline: none;
     }
-    QTableWidget::item { padding: 8px; }
-    QTableWidget::item:selected { 
+    QTableView::item { padding: 8px; }
+    QTableView::item:selected { 
         color: #00F0FF; 
         background-color: #1C2030; 
         border-bottom: 2px solid #00F0FF; 
@@ -52,7 +68,7 @@ MODERN_STYLE = """
         font-weight: bold;
     }
     QPushButton:hover { background-color: #0078D4; border-color: #00F0FF; }
-    QLineEdit, QSpinBox, QDateTimeEdit { 
+    QLineEdit, QSpinBox, QDateTimeEdit, QComboBox { 
         background-color: #1C2030; 
         border: 1px solid #2D3245; 
         padding: 6px; 
@@ -89,19 +105,125 @@ class AddDeviceDialog(QDialog):
         self.name_in = QLineEdit(); self.name_in.setPlaceholderText("Device Name")
         self.ip_in = QLineEdit(); self.ip_in.setPlaceholderText("IP Address")
         self.port_in = QSpinBox(); self.port_in.setRange(1, 65535); self.port_in.setValue(80)
+        self.parent_in = QLineEdit(); self.parent_in.setPlaceholderText("Parent IP[:port], auto, or empty")
         btn = QPushButton("Save Device"); btn.clicked.connect(self.accept)
         layout.addWidget(QLabel("Device Label / Name:")); layout.addWidget(self.name_in)
         layout.addWidget(QLabel("IP Address:")); layout.addWidget(self.ip_in)
         layout.addWidget(QLabel("Monitoring Port:")); layout.addWidget(self.port_in)
+        layout.addWidget(QLabel("Upstream Device (optional):")); layout.addWidget(self.parent_in)
         layout.addSpacing(10); layout.addWidget(btn)
 
 
+class TimelineChart(QWidget):
+    """
+    نمودار وضعیت آنلاین/آفلاین و تاخیر. برای هر پیکسل حداکثر یک سطل از دیتابیس
+    خوانده می‌شود (min/max/avg)، پس تعداد نقاط رسم شده به طول بازه بستگی ندارد.
+    چرخ ماوس: زوم، کشیدن: جابجایی.
+    """
+    def __init__(self, fetch, parent=None):
+        super().__init__(parent)
+        self.fetch = fetch  # (f, t, buckets) -> (bucket, rows)
+        self.f, self.t = 0, 3600
+        self.bucket, self.data = 1, []
+        self.drag_x = None
+        self.setMinimumHeight(220)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(150)
+        self.reload_timer.timeout.connect(self.reload)
+
+    def set_range(self, f, t):
+        self.f, self.t = f, max(t, f + 60)
+        self.reload()
+
+    def reload(self):
+        self.bucket, self.data = self.fetch(
+            int(self.f), int(self.t), max(1, self.plot_rect().width())
+        )
+        self.update()
+
+    def plot_rect(self):
+        return self.rect().adjusted(60, 10, -10, -24)
+
+    def x_of(self, sec, r):
+        return r.left() + (sec - self.f) * r.width() / (self.t - self.f)
+
+    def paintEvent(self, event):
+        p = QPainter(self)
+        p.fillRect(self.rect(), QColor("#161925"))
+        r = self.plot_rect()
+        band = QRect(r.left(), r.top(), r.width(), 18)
+        plot = QRect(r.left(), r.top() + 28, r.width(), r.height() - 28)
+        lat_max = max((b[4] for b in self.data if b[4] is not None), default=None) or 1.0
+
+        def y(v):
+            return plot.bottom() - v / lat_max * plot.height()
+
+        avg_line = QPolygonF()
+        p.setPen(QPen(QColor("#3D4A6B"), 1))
+        for start, n, up, lo, hi, avg in self.data:
+            x0, x1 = self.x_of(start, r), self.x_of(start + self.bucket, r)
+            if x1 < r.left() or x0 > r.right():
+                continue
+            color = "#00F0FF" if up == n else "#FF4560" if not up else "#FFA500"
+            p.fillRect(QRectF(x0, band.top(), max(1.0, x1 - x0), band.height()), QColor(color))
+            if lo is not None:
+                xm = (x0 + x1) / 2
+                p.drawLine(QPointF(xm, y(lo)), QPointF(xm, y(hi)))
+                avg_line.append(QPointF(xm, y(avg)))
+        p.setPen(QPen(QColor("#00F0FF"), 1))
+        p.drawPolyline(avg_line)
+
+        p.setPen(QColor("#2D3245"))
+        p.drawRect(plot)
+        p.setPen(QColor("#8B949E"))
+        p.drawText(QRect(0, band.top(), r.left() - 6, band.height()),
+                   Qt.AlignRight | Qt.AlignVCenter, "STATUS")
+        p.drawText(QRect(0, plot.top(), r.left() - 6, 16), Qt.AlignRight, f"{lat_max:.0f} ms")
+        p.drawText(QRect(0, plot.bottom() - 16, r.left() - 6, 16), Qt.AlignRight, "0 ms")
+        p.drawText(QRect(r.left(), r.bottom() + 4, r.width(), 18), Qt.AlignLeft,
+                   epoch_to_ts(int(self.f)))
+        p.drawText(QRect(r.left(), r.bottom() + 4, r.width(), 18), Qt.AlignRight,
+                   epoch_to_ts(int(self.t)))
+
+    def wheelEvent(self, event):
+        r = self.plot_rect()
+        span = self.t - self.f
+        anchor = self.f + (event.pos().x() - r.left()) / max(1, r.width()) * span
+        new_span = max(60.0, span * (0.8 if event.angleDelta().y() > 0 else 1.25))
+        self.f = anchor - (anchor - self.f) * new_span / span
+        self.t = self.f + new_span
+        self.update()
+        self.reload_timer.start()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_x = event.pos().x()
+
+    def mouseMoveEvent(self, event):
+        if self.drag_x is None:
+            return
+        shift = (self.drag_x - event.pos().x()) * (self.t - self.f) / max(1, self.plot_rect().width())
+        self.f += shift
+        self.t += shift
+        self.drag_x = event.pos().x()
+        self.update()
+        self.reload_timer.start()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_x = None
+
+    def resizeEvent(self, event):
+        self.reload_timer.start()
+        super().resizeEvent(event)
+
+
 class LogWindow(QDialog):
     def __init__(self, ip, port, name):
         super().__init__()
         self.ip, self.port = ip, port
         self.setWindowTitle(f"History: {name} ({ip}:{port})")
-        self.resize(850, 550); self.setStyleSheet(MODERN_STYLE)
+        self.resize(850, 750); self.setStyleSheet(MODERN_STYLE)
         layout = QVBoxLayout(self)
         filter_box = QHBoxLayout()
         self.from_dt = QDateTimeEdit(datetime.now().replace(hour=0, minute=0, second=0))
@@ -113,6 +235,8 @@ class LogWindow(QDialog):
         filter_box.addWidget(QLabel("To:")); filter_box.addWidget(self.to_dt)
         filter_box.addWidget(btn_f); filter_box.addWidget(btn_e)
         layout.addLayout(filter_box)
+        self.chart = TimelineChart(self.fetch_timeline)
+        layout.addWidget(self.chart)
         self.log_table = QTableWidget(0, 4)
         self.log_table.setHorizontalHeaderLabels(["Timestamp", "Ping", "Port Status", "Health"])
         self.log_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
@@ -130,6 +254,7 @@ class LogWindow(QDialog):
             (self.ip, self.port, f, t)
         ).fetchall()
         conn.close()
+        self.chart.set_range(ts_to_epoch(f), ts_to_epoch(t))
         self.log_table.setRowCount(len(rows))
         for r, row in enumerate(rows):
             for c, val in enumerate(row):
@@ -146,6 +271,13 @@ class LogWindow(QDialog):
                     item.setForeground(QColor("#00F0FF") if val == 1 else QColor("#FF4560"))
                 self.log_table.setItem(r, c, item)
 
+    def fetch_timeline(self, f, t, buckets):
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        try:
+            return timeline(conn, self.ip, self.port, f, t, buckets)
+        finally:
+            conn.close()
+
     def export_logs(self):
         path, _ = QFileDialog.getSaveFileName(self, "Export", "", "Excel (*.xlsx)")
         if path:
@@ -154,6 +286,58 @@ class LogWindow(QDialog):
             pd.DataFrame(data, columns=["Time", "Ping", "Port", "Status"]).to_excel(path, index=False)
 
 
+class SlaReportDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("SLA / Uptime Report")
+        self.resize(1000, 600); self.setStyleSheet(MODERN_STYLE)
+        layout = QVBoxLayout(self)
+        filter_box = QHBoxLayout()
+        now = datetime.now()
+        self.from_dt = QDateTimeEdit(now.replace(day=1, hour=0, minute=0, second=0))
+        self.to_dt = QDateTimeEdit(now)
+        self.from_dt.setCalendarPopup(True); self.to_dt.setCalendarPopup(True)
+        self.group_by = QComboBox(); self.group_by.addItems(["Device", "Site"])
+        btn_r = QPushButton("Run"); btn_r.clicked.connect(self.run_report)
+        btn_e = QPushButton("Export Excel"); btn_e.clicked.connect(self.export_report)
+        filter_box.addWidget(QLabel("From:")); filter_box.addWidget(self.from_dt)
+        filter_box.addWidget(QLabel("To:")); filter_box.addWidget(self.to_dt)
+        filter_box.addWidget(QLabel("Group by:")); filter_box.addWidget(self.group_by)
+        filter_box.addWidget(btn_r); filter_box.addWidget(btn_e)
+        layout.addLayout(filter_box)
+        self.model = DataFrameModel(parent=self)
+        self.report_table = QTableView(); self.report_table.setModel(self.model)
+        self.report_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.report_table.setAlternatingRowColors(True); layout.addWidget(self.report_table)
+        self.run_report()
+
+    def run_report(self):
+        f = self.from_dt.dateTime().toString("yyyy-MM-dd HH:mm:ss")
+        t = self.to_dt.dateTime().toString("yyyy-MM-dd HH:mm:ss")
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        try:
+            last, top = summary_watermark(conn)
+            if top - last > SUMMARY_TAIL_MAX:
+                QMessageBox.information(
+                    self, "SLA Report",
+                    "SLA summaries are still being built in the background.\n"
+                    "Please try again in a few minutes."
+                )
+                return
+            df = sla_report(conn, f, t, by=self.group_by.currentText().lower())
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to build report:\n{str(e)}")
+            return
+        finally:
+            conn.close()
+        self.model.set_frame(df)
+
+    def export_report(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export", "", "Excel (*.xlsx)")
+        if path:
+            self.model.df.to_excel(path, index=False)
+
+
 class SyncProfileDialog(QDialog):
     """
     مدیریت لیست سرورهای SQL / دیتابیس / کوئری.
@@ -256,13 +440,12 @@ class SyncProfileDialog(QDialog):
         dlg = EditProfileForm(self)
         if dlg.exec_():
             data = dlg.get_data()
-            self.conn.execute(
+            self.write(
                 "INSERT INTO sync_profiles (title, server, database, username, password, query, active) "
                 "VALUES (?,?,?,?,?,?,?)",
                 (data['title'], data['server'], data['database'], data['username'],
                  data['password'], data['query'], 1 if data['active'] else 0)
             )
-            self.conn.commit()
             self.load_profiles()
 
     def edit_profile(self):
@@ -290,13 +473,12 @@ class SyncProfileDialog(QDialog):
         })
         if dlg.exec_():
             data = dlg.get_data()
-            self.conn.execute(
+            self.write(
                 "UPDATE sync_profiles SET title=?, server=?, database=?, username=?, password=?, query=?, active=? "
                 "WHERE id=?",
                 (data['title'], data['server'], data['database'], data['username'],
                  data['password'], data['query'], 1 if data['active'] else 0, id_)
             )
-            self.conn.commit()
             self.load_profiles()
 
     def delete_profile(self):
@@ -307,10 +489,21 @@ class SyncProfileDialog(QDialog):
         if QMessageBox.question(
             self, "Confirm", "Delete this profile?", QMessageBox.Yes | QMessageBox.No
         ) == QMessageBox.Yes:
-            self.conn.execute("DELETE FROM sync_profiles WHERE id=?", (id_,))
-            self.conn.commit()
+            self.write("DELETE FROM sync_profiles WHERE id=?", (id_,))
             self.load_profiles()
 
+    def write(self, sql, params):
+        try:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            QMessageBox.warning(
+                self, "Database Busy",
+                f"Changes were not saved, the database is busy:\n{str(e)}\n"
+                "Please try again in a moment."
+            )
+
     def get_active_profiles(self):
         rows = self.conn.execute(
             "SELECT title, server, database, username, password, query "
@@ -403,90 +596,1395 @@ class EditProfileForm(QDialog):
         }
 
 
+# =========================
+# DEVICE REGISTRY
+# =========================
+class Device:
+    __slots__ = ("name", "ip", "port", "agent", "parent")
+
+    def __init__(self, name, ip, port, agent=None, parent=None):
+        self.name = name
+        self.ip = ip
+        self.port = port
+        self.agent = agent
+        self.parent = parent
+
+    @property
+    def key(self):
+        return (self.ip, self.port)
+
+    def same_as(self, other):
+        return (self.name, self.agent, self.parent) == (other.name, other.agent, other.parent)
+
+
+class RegistrySnapshot:
+    """نسخه فقط‌خواندنی از لیست دستگاه‌ها؛ هرگز بعد از ساخت تغییر نمی‌کند."""
+    __slots__ = ("generation", "devices", "index")
+
+    def __init__(self, generation, devices):
+        self.generation = generation
+        self.devices = devices
+        self.index = {d.key: i for i, d in enumerate(devices)}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    def __getitem__(self, i):
+        return self.devices[i]
+
+    def find(self, ip, port):
+        return self.index.get((ip, port), -1)
+
+
+class DeviceRegistry:
+    """
+    لیست دستگاه‌ها به صورت copy-on-write: نویسنده (thread رابط کاربری) یک snapshot جدید
+    می‌سازد و فقط ارجاع را عوض می‌کند؛ خواننده‌ها (GUI و موتور چک) بدون قفل snapshot
+    فعلی را می‌خوانند. listener ها با (generation, [(kind, device), ...]) صدا زده می‌شوند.
+    """
+    ADDED, REMOVED, MODIFIED = "add", "remove", "modify"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = RegistrySnapshot(0, ())
+        self._listeners = []
+
+    def snapshot(self):
+        return self._snapshot
+
+    def subscribe(self, fn):
+        self._listeners.append(fn)
+
+    def replace(self, devices):
+        with self._lock:
+            old = self._snapshot
+            new_devices, seen, changes = [], set(), []
+            for d in devices:
+                if d.key in seen:
+                    continue
+                seen.add(d.key)
+                i = old.find(*d.key)
+                if i < 0:
+                    changes.append((self.ADDED, d))
+                elif not old[i].same_as(d):
+                    changes.append((self.MODIFIED, d))
+                else:
+                    d = old[i]
+                new_devices.append(d)
+            changes.extend((self.REMOVED, d) for d in old if d.key not in seen)
+            if not changes and len(new_devices) == len(old) and all(
+                    a is b for a, b in zip(new_devices, old)):
+                return old
+            snap = RegistrySnapshot(old.generation + 1, tuple(new_devices))
+            self._snapshot = snap
+        for fn in self._listeners:
+            fn(snap.generation, changes)
+        return snap
+
+
+# =========================
+# PROBE ENGINE
+# =========================
+def init_schema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS devices (name TEXT, ip TEXT, port INTEGER)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS device_logs ("
+        "ip TEXT, port INTEGER, ping INTEGER, port_status INTEGER, "
+        "overall INTEGER, timestamp TEXT)"
+    )
+    # ستون agent: دستگاه‌هایی که به یک agent راه دور سپرده شده‌اند
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(devices)")}
+    if "agent" not in cols:
+        conn.execute("ALTER TABLE devices ADD COLUMN agent TEXT")
+    # parent: دستگاه upstream (ip یا ip:port) یا auto برای gateway همان /24
+    if "parent" not in cols:
+        conn.execute("ALTER TABLE devices ADD COLUMN parent TEXT")
+    # latency: زمان اتصال TCP به میلی‌ثانیه (برای پورت بسته NULL)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(device_logs)")}
+    if "latency" not in cols:
+        conn.execute("ALTER TABLE device_logs ADD COLUMN latency REAL")
+    # آخرین وضعیت شناخته شده هر دستگاه برای نمایش فوری هنگام اجرا
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS device_state ("
+        "ip TEXT, port INTEGER, ping INTEGER, port_ok INTEGER, overall INTEGER, "
+        "checked_at TEXT, latency REAL, changed_at TEXT, PRIMARY KEY (ip, port))"
+    )
+    conn.commit()
+    init_summary_schema(conn)
+
+
+LOG_INSERT = (
+    "INSERT INTO device_logs (ip, port, ping, port_status, overall, timestamp, latency) "
+    "VALUES (?,?,?,?,?,?,?)"
+)
+# changed_at فقط وقتی وضعیت overall عوض شود جلو می‌رود؛ نتایج دیرتر رسیده نادیده گرفته می‌شوند
+STATE_UPSERT = (
+    "INSERT INTO device_state (ip, port, ping, port_ok, overall, checked_at, latency, changed_at) "
+    "VALUES (?1,?2,?3,?4,?5,?6,?7,?6) "
+    "ON CONFLICT (ip, port) DO UPDATE SET "
+    "changed_at = CASE WHEN overall = excluded.overall THEN changed_at ELSE excluded.changed_at END, "
+    "ping = excluded.ping, port_ok = excluded.port_ok, overall = excluded.overall, "
+    "checked_at = excluded.checked_at, latency = excluded.latency "
+    "WHERE excluded.checked_at >= device_state.checked_at"
+)
+
+
+def record_results(conn, rows):
+    """rows: (ip, port, ping, port_ok, overall, timestamp, latency)"""
+    conn.executemany(LOG_INSERT, rows)
+    conn.executemany(STATE_UPSERT, rows)
+    conn.commit()
+
+
+class ResultWriter:
+    """
+    نوشتن نتایج SerialWorker در یک thread جدا تا probe ها منتظر قفل دیتابیس نمانند
+    (مثلاً هنگام ساخت ایندکس‌ها). اگر نوشتن ناموفق باشد نتایج نگه داشته و دوباره نوشته می‌شوند.
+    """
+    RETRY_SEC = 5
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.rows = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, row):
+        self.rows.put(row)
+
+    def close(self):
+        self.rows.put(None)
+        self.thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        pending, closing = [], False
+        while not closing:
+            try:
+                item = self.rows.get(timeout=self.RETRY_SEC if pending else None)
+                while True:
+                    if item is None:
+                        closing = True
+                    else:
+                        pending.append(item)
+                    item = self.rows.get_nowait()
+            except queue.Empty:
+                pass
+            if not pending:
+                continue
+            try:
+                record_results(conn, pending)
+                pending = []
+            except sqlite3.Error as e:
+                conn.rollback()
+                log.warning("failed to store %d results, will retry (%s)", len(pending), e)
+        if pending:
+            log.warning("%d results not stored on shutdown", len(pending))
+        conn.close()
+
+
+def load_device_state(conn):
+    return conn.execute(
+        "SELECT ip, port, ping, port_ok, overall, latency, checked_at FROM device_state"
+    ).fetchall()
+
+
+def hidden_process_kwargs():
+    if platform.system().lower() != "windows":
+        return {}
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = 0
+    return {"startupinfo": startupinfo, "creationflags": 0x08000000}  # CREATE_NO_WINDOW
+
+
+def probe_device(ip, port, ping_count, proc_kwargs=None):
+    try:
+        p_res = subprocess.run(
+            ["ping", "-n" if platform.system().lower() == "windows" else "-c",
+             str(ping_count), ip],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            **(proc_kwargs or {})
+        )
+        p_ok = (p_res.returncode == 0)
+    except Exception:
+        p_ok = False
+
+    s_ok = False
+    latency = None
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(2)
+            t0 = time.perf_counter()
+            if s.connect_ex((ip, port)) == 0:
+                s_ok = True
+                latency = round((time.perf_counter() - t0) * 1000, 1)
+    except Exception:
+        s_ok = False
+
+    ov = 1 if (p_ok and s_ok) else 0
+    return p_ok, s_ok, ov, latency
+
+
+def format_ts(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+UPSTREAM_PROBE_EVERY = 6   # دستگاه پشت upstream قطع فقط هر چند دور یکبار واقعا چک می‌شود
+
+
+def resolve_parents(devices):
+    """
+    key -> parent key از ستون parent: "ip" یا "ip:port" یک دستگاه دیگر، یا "auto" برای
+    gateway همان /24 (.1 و در غیر این صورت .254). ارجاع به دستگاه ناموجود و حلقه‌ها حذف می‌شوند.
+    """
+    keys = {d.key for d in devices}
+    by_ip = {}
+    for d in devices:
+        by_ip.setdefault(d.ip, d.key)
+    parents = {}
+    for d in devices:
+        ref = (d.parent or "").strip()
+        if not ref:
+            continue
+        if ref.lower() == "auto":
+            net = d.ip.rsplit(".", 1)[0]
+            p = next((k for k in (by_ip.get(f"{net}.1"), by_ip.get(f"{net}.254"))
+                      if k and k[0] != d.ip), None)
+        else:
+            ip, _, port = ref.rpartition(":")
+            if ip and port.isdigit() and (ip, int(port)) in keys:
+                p = (ip, int(port))
+            else:
+                p = by_ip.get(ip or ref)
+        if p and p != d.key:
+            parents[d.key] = p
+
+    for start in list(parents):
+        path, k = [], start
+        while k in parents:
+            if k in path:
+                for c in path[path.index(k):]:
+                    parents.pop(c, None)
+                break
+            path.append(k)
+            k = parents[k]
+    return parents
+
+
+class Topology:
+    __slots__ = ("parents", "depth")
+
+    def __init__(self, devices):
+        self.parents = resolve_parents(devices)
+        self.depth = {}
+        for start in self.parents:
+            path, k = [], start
+            while k in self.parents and k not in self.depth:
+                path.append(k)
+                k = self.parents[k]
+            base = self.depth.get(k, 0)
+            for c in reversed(path):
+                base += 1
+                self.depth[c] = base
+
+    def order(self, devices):
+        """parent ها قبل از فرزندان؛ ترتیب قبلی در هر سطح حفظ می‌شود."""
+        if not self.parents:
+            return devices
+        return sorted(devices, key=lambda d: self.depth.get(d.key, 0))
+
+
+class UpstreamGate:
+    """
+    در هر دور، دستگاهی که parent آن در همین دور قطع دیده شده بدون چک «unreachable
+    (upstream)» می‌شود و فقط هر UPSTREAM_PROBE_EVERY دور یکبار واقعا چک می‌شود.
+    چون parent ها اول چک می‌شوند، با برگشتن parent فرزندان در همان دور چک می‌شوند.
+    """
+    def __init__(self):
+        self.sweep = 0
+        self.down = set()
+        self.last_probe = {}
+
+    def start_sweep(self):
+        self.sweep += 1
+        self.down = set()
+
+    def should_probe(self, key, parent):
+        if parent is None or parent not in self.down:
+            return True
+        return self.sweep - self.last_probe.setdefault(key, self.sweep) >= UPSTREAM_PROBE_EVERY
+
+    def record(self, key, overall, probed=True):
+        if probed:
+            self.last_probe[key] = self.sweep
+        if not overall:
+            self.down.add(key)
+
+
 # =========================
 # WORKER THREAD
 # =========================
 class SerialWorker(QThread):
     result_ready = pyqtSignal(dict); tick = pyqtSignal(int, int); checking_now = pyqtSignal(str, int)
     
-    def __init__(self, dev, i_fn, p_fn): 
+    def __init__(self, registry, i_fn, p_fn):
         super().__init__()
-        self.devices = dev
+        self.registry = registry
         self.i_fn = i_fn
         self.p_fn = p_fn
         self.running = True
 
+    def remote_down(self, keys):
+        """
+        دستگاه‌های agent از `keys` که آخرین نتیجه‌شان در device_state قطع است؛ collector
+        (داخل GUI یا جدا با --collector) همین جدول را به‌روز می‌کند. device_state یک سطر
+        برای هر دستگاه دارد پس هر دور یکبار خواندنش ارزان است.
+        """
+        conn = sqlite3.connect(DB_NAME)
+        try:
+            rows = conn.execute("SELECT ip, port FROM device_state WHERE overall = 0").fetchall()
+        except sqlite3.Error as e:
+            log.warning("failed to read agent device state: %s", e)
+            return set()
+        finally:
+            conn.close()
+        return {r for r in rows if r in keys}
+
     def run(self):
-        startupinfo = None
-        creationflags = 0
-        if platform.system().lower() == "windows":
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = 0
-            creationflags = 0x08000000  # CREATE_NO_WINDOW
-            
+        proc_kwargs = hidden_process_kwargs()
+        conn = sqlite3.connect(DB_NAME)
+        state = {(r[0], r[1]): (r[4], r[6]) for r in load_device_state(conn)}
+        conn.close()
+
+        writer = ResultWriter(DB_NAME)
+        gate = UpstreamGate()
+        topo_gen = None
         while self.running:
-            for d in list(self.devices):
+            snap = self.registry.snapshot()
+            # ترتیب parent قبل از فرزند فقط با تغییر لیست دستگاه‌ها دوباره ساخته می‌شود
+            if topo_gen != snap.generation:
+                topo, topo_gen = Topology(snap), snap.generation
+                ordered = topo.order(snap)
+                parents = set(topo.parents.values())
+                remote = {d.key for d in snap if d.agent and d.key in parents}
+            devices = ordered
+            # دور اول: اول دستگاه‌های آفلاین/بدون سابقه، بعد قدیمی‌ترین چک‌ها
+            if state is not None:
+                devices = topo.order(sorted(snap, key=lambda d: state.get(d.key, (0, ""))))
+                state = None
+            remote_down = self.remote_down(remote) if remote else ()
+            gate.start_sweep()
+            for d in devices:
                 if not self.running:
                     break
-                ip, port = d['ip'], d['port']
+                # دستگاه‌های سپرده شده به agent توسط همان agent چک می‌شوند؛
+                # وضعیت گزارش شده‌شان برای فرزندان محلی به gate داده می‌شود
+                if d.agent:
+                    if d.key in remote_down:
+                        gate.record(d.key, 0, probed=False)
+                    continue
+                # دستگاهی که وسط دور حذف شده دیگر چک نشود
+                if self.registry.snapshot().find(*d.key) < 0:
+                    continue
+                ip, port = d.ip, d.port
+                if not gate.should_probe(d.key, topo.parents.get(d.key)):
+                    gate.record(d.key, 0, probed=False)
+                    self.result_ready.emit({
+                        "ip": ip, "port": port, "ping": False, "port_ok": False,
+                        "overall": 0, "latency": None, "upstream": True
+                    })
+                    continue
                 self.checking_now.emit(ip, port)
-                
-                try:
-                    p_res = subprocess.run(
-                        ["ping", "-n" if platform.system().lower()=="windows" else "-c",
-                         str(self.p_fn()), ip],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        stdin=subprocess.DEVNULL,
-                        startupinfo=startupinfo,
-                        creationflags=creationflags
-                    )
-                    p_ok = (p_res.returncode == 0)
-                except Exception:
-                    p_ok = False
-                
-                s_ok = False
-                try:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                        s.settimeout(2)
-                        if s.connect_ex((ip, port)) == 0:
-                            s_ok = True
-                except Exception:
-                    s_ok = False
-                
-                ov = 1 if (p_ok and s_ok) else 0
-                conn = sqlite3.connect(DB_NAME)
-                conn.execute(
-                    "INSERT INTO device_logs VALUES (?,?,?,?,?,?)",
-                    (ip, port, int(p_ok), int(s_ok), ov,
-                     datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                )
-                conn.commit()
-                conn.close()
+
+                p_ok, s_ok, ov, latency = probe_device(ip, port, self.p_fn(), proc_kwargs)
+                gate.record(d.key, ov)
+                writer.put((ip, port, int(p_ok), int(s_ok), ov,
+                            datetime.now().strftime("%Y-%m-%d %H:%M:%S"), latency))
                 self.result_ready.emit({
                     "ip": ip, "port": port,
-                    "ping": p_ok, "port_ok": s_ok, "overall": ov
+                    "ping": p_ok, "port_ok": s_ok, "overall": ov, "latency": latency
                 })
-            
+
             w = self.i_fn()
             for i in range(w, 0, -1):
                 if not self.running:
                     break
                 self.tick.emit(i, w)
                 self.msleep(1000)
+        writer.close()
+
+
+# =========================
+# DISTRIBUTED AGENTS / COLLECTOR
+# =========================
+# پروتکل باینری بین agent و collector؛ هر فریم = طول بدنه + نوع پیام + بدنه
+MSG_HELLO, MSG_ASSIGN, MSG_BATCH, MSG_ACK = 1, 2, 3, 4
+MAX_FRAME = 16 * 1024 * 1024
+BATCH_MAX = 500          # حداکثر رکورد در هر batch
+FLUSH_SEC = 2.0          # حداکثر تاخیر ارسال نتایج
+COLLECTOR_DB_TIMEOUT = 30   # انتظار collector برای قفل دیتابیس در هر batch
+# خیلی بیشتر از تاخیر نوشتن؛ timeout فقط باعث ارسال دوباره می‌شود که collector آن را کنار می‌گذارد
+ACK_TIMEOUT = 4 * COLLECTOR_DB_TIMEOUT
+ASSIGN_REFRESH = 60      # هر چند ثانیه لیست دستگاه‌ها از collector دوباره گرفته شود
+
+_FRAME_HDR = struct.Struct("!IB")    # len, type
+_HELLO_HDR = struct.Struct("!I")     # session + agent id (utf-8)
+_COUNT = struct.Struct("!I")
+_DEV_HDR = struct.Struct("!HIB")     # port, parent index, len(ip) + ip
+NO_PARENT = 0xFFFFFFFF
+_BATCH_HDR = struct.Struct("!IH")    # seq, count
+_REC_HDR = struct.Struct("!IHBHB")   # timestamp, port, flags, latency ms, len(ip) + ip
+NO_LATENCY = 0xFFFF
+_ACK = struct.Struct("!I")           # seq
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def send_frame(sock, kind, payload=b""):
+    sock.sendall(_FRAME_HDR.pack(len(payload), kind) + payload)
+
+
+def recv_frame(sock):
+    size, kind = _FRAME_HDR.unpack(_recv_exact(sock, _FRAME_HDR.size))
+    if size > MAX_FRAME:
+        raise ConnectionError(f"frame too large ({size} bytes)")
+    return kind, _recv_exact(sock, size)
+
+
+def pack_assignment(devices):
+    """devices: (ip, port, parent) که parent ایندکس دستگاه upstream در همین لیست است یا None"""
+    parts = [_COUNT.pack(len(devices))]
+    for ip, port, parent in devices:
+        raw = ip.encode()
+        parts.append(_DEV_HDR.pack(port, NO_PARENT if parent is None else parent, len(raw)) + raw)
+    return b"".join(parts)
+
+
+def unpack_assignment(payload):
+    count, = _COUNT.unpack_from(payload)
+    off = _COUNT.size
+    devices = []
+    for _ in range(count):
+        port, parent, n = _DEV_HDR.unpack_from(payload, off)
+        off += _DEV_HDR.size
+        devices.append((payload[off:off + n].decode(), port, None if parent == NO_PARENT else parent))
+        off += n
+    return devices
+
+
+def pack_batch(seq, records):
+    """records: (timestamp, ip, port, ping, port_ok, overall, latency, upstream)"""
+    parts = [_BATCH_HDR.pack(seq, len(records))]
+    for ts, ip, port, p_ok, s_ok, ov, latency, upstream in records:
+        raw = ip.encode()
+        flags = int(p_ok) | int(s_ok) << 1 | int(ov) << 2 | int(upstream) << 3
+        lat = NO_LATENCY if latency is None else min(int(round(latency)), NO_LATENCY - 1)
+        parts.append(_REC_HDR.pack(ts, port, flags, lat, len(raw)) + raw)
+    return b"".join(parts)
+
+
+def unpack_batch(payload):
+    seq, count = _BATCH_HDR.unpack_from(payload)
+    off = _BATCH_HDR.size
+    records = []
+    for _ in range(count):
+        ts, port, flags, lat, n = _REC_HDR.unpack_from(payload, off)
+        off += _REC_HDR.size
+        ip = payload[off:off + n].decode()
+        off += n
+        records.append((ts, ip, port, flags & 1, flags >> 1 & 1, flags >> 2 & 1,
+                        None if lat == NO_LATENCY else float(lat), bool(flags >> 3 & 1)))
+    return seq, records
+
+
+class ProbeAgent:
+    """
+    اجرای بدون رابط گرافیکی موتور چک برای دستگاه‌هایی که collector به این agent سپرده.
+    نتایج در یک بافر محدود جمع و به صورت batch ارسال می‌شوند؛ batch تا دریافت ACK
+    نگه داشته می‌شود و بعد از اتصال مجدد دوباره فرستاده می‌شود.
+    """
+    def __init__(self, agent_id, addr, interval=10, ping_count=1, buffer_size=100_000):
+        self.agent_id = agent_id
+        self.addr = addr
+        self.interval = interval
+        self.ping_count = ping_count
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.assigned = []
+        # اگر collector در دسترس نباشد قدیمی‌ترین نتایج دور ریخته می‌شوند
+        self.pending = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.cond = threading.Condition()
+        self.running = True
+
+    def run(self):
+        threading.Thread(target=self._send_loop, daemon=True).start()
+        proc_kwargs = hidden_process_kwargs()
+        gate = UpstreamGate()
+        while self.running:
+            devices = self.assigned
+            gate.start_sweep()
+            for ip, port, parent in devices:
+                if not self.running:
+                    break
+                key = (ip, port)
+                if not gate.should_probe(key, None if parent is None else devices[parent][:2]):
+                    gate.record(key, 0, probed=False)
+                    self._enqueue((int(time.time()), ip, port, 0, 0, 0, None, True))
+                    continue
+                p_ok, s_ok, ov, latency = probe_device(ip, port, self.ping_count, proc_kwargs)
+                gate.record(key, ov)
+                self._enqueue((int(time.time()), ip, port, int(p_ok), int(s_ok), ov, latency, False))
+            # تا رسیدن اولین لیست از collector منتظر کل interval نمان
+            time.sleep(self.interval if devices else 1)
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+    def _enqueue(self, record):
+        with self.cond:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(record)
+            if len(self.pending) >= BATCH_MAX:
+                self.cond.notify()
+
+    def _next_batch(self):
+        with self.cond:
+            self.cond.wait_for(
+                lambda: len(self.pending) >= BATCH_MAX or not self.running, FLUSH_SEC
+            )
+            n = min(len(self.pending), BATCH_MAX)
+            return [self.pending.popleft() for _ in range(n)]
+
+    def _hello(self, sock):
+        send_frame(sock, MSG_HELLO, _HELLO_HDR.pack(self.session) + self.agent_id.encode())
+        kind, payload = recv_frame(sock)
+        if kind != MSG_ASSIGN:
+            raise ConnectionError(f"unexpected reply {kind} to hello")
+        self.assigned = unpack_assignment(payload)
+        log.info("agent %s: %d devices assigned", self.agent_id, len(self.assigned))
+
+    def _send_loop(self):
+        backoff = 1
+        batch = []
+        while self.running:
+            try:
+                with socket.create_connection(self.addr, timeout=ACK_TIMEOUT) as sock:
+                    self._hello(sock)
+                    last_hello = time.monotonic()
+                    backoff = 1
+                    while self.running:
+                        if not batch:
+                            batch = self._next_batch()
+                        if batch:
+                            send_frame(sock, MSG_BATCH, pack_batch(self.seq, batch))
+                            kind, payload = recv_frame(sock)
+                            if kind != MSG_ACK or _ACK.unpack(payload)[0] != self.seq:
+                                raise ConnectionError("bad ack")
+                            self.seq += 1
+                            batch = []
+                        if time.monotonic() - last_hello > ASSIGN_REFRESH:
+                            self._hello(sock)
+                            last_hello = time.monotonic()
+            except (OSError, struct.error) as e:
+                log.warning("agent %s: collector %s:%s unavailable (%s), retry in %ss, "
+                            "%d results buffered, %d dropped",
+                            self.agent_id, *self.addr, e, backoff,
+                            len(self.pending) + len(batch), self.dropped)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+class _CollectorHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.collector.serve_agent(self.request)
+
+
+class _CollectorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Collector:
+    """
+    دریافت نتایج agent ها، نوشتن در device_logs و اطلاع به GUI از طریق on_result.
+    فقط یک thread در دیتابیس می‌نویسد؛ صف محدود باعث می‌شود وقتی نوشتن عقب بیفتد
+    خواندن از سوکت agent ها متوقف شود (backpressure در سطح TCP).
+    """
+    def __init__(self, addr, db_path, on_result=None, queue_size=64):
+        self.db_path = db_path
+        self.on_result = on_result
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.last_seq = {}  # (agent, session) -> آخرین seq نوشته شده
+        self.server = _CollectorServer(addr, _CollectorHandler)
+        self.server.collector = self
+
+    def serve_forever(self):
+        writer = threading.Thread(target=self._write_loop, daemon=True)
+        writer.start()
+        log.info("collector listening on %s:%s", *self.server.server_address)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.batches.put(None)
+            writer.join()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def assignment(self, agent_id):
+        # به همان ترتیب دور اول SerialWorker: آفلاین/بدون سابقه، بعد قدیمی‌ترین چک
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            "SELECT d.name, d.ip, d.port, d.agent, d.parent FROM devices d "
+            "LEFT JOIN device_state s ON s.ip = d.ip AND s.port = d.port "
+            "ORDER BY COALESCE(s.overall, 0), s.checked_at"
+        ).fetchall()
+        conn.close()
+        everything = [Device(*r) for r in rows]
+        topo = Topology(everything)
+        devices = topo.order([d for d in everything if d.agent == agent_id])
+        pos = {d.key: i for i, d in enumerate(devices)}
+        # agent فقط نتایج خودش را می‌بیند؛ parent متعلق به agent دیگر یا GUI نادیده گرفته می‌شود
+        for d in devices:
+            p = topo.parents.get(d.key)
+            if p is not None and p not in pos:
+                log.warning("agent %s: parent %s:%s of %s:%s is not probed by this agent, ignored",
+                            agent_id, p[0], p[1], d.ip, d.port)
+        return [(d.ip, d.port, pos.get(topo.parents.get(d.key))) for d in devices]
+
+    def serve_agent(self, sock):
+        agent_id = session = None
+        while True:
+            try:
+                kind, payload = recv_frame(sock)
+                if kind == MSG_HELLO:
+                    session, = _HELLO_HDR.unpack_from(payload)
+                    agent_id = payload[_HELLO_HDR.size:].decode()
+                    send_frame(sock, MSG_ASSIGN, pack_assignment(self.assignment(agent_id)))
+                elif kind == MSG_BATCH and agent_id is not None:
+                    seq, records = unpack_batch(payload)
+                    done, result = threading.Event(), [False]
+                    self.batches.put(((agent_id, session), seq, records, done, result))
+                    done.wait()
+                    # نوشتن ناموفق: بدون ACK اتصال بسته می‌شود تا agent دوباره بفرستد
+                    if not result[0]:
+                        raise ConnectionError(f"batch {seq} not stored")
+                    send_frame(sock, MSG_ACK, _ACK.pack(seq))
+                else:
+                    return
+            except (OSError, struct.error, UnicodeDecodeError) as e:
+                log.info("agent %s disconnected (%s)", agent_id, e)
+                return
+
+    def _write_loop(self):
+        # GUI (SerialWorker / SummaryWorker) هم در همین فایل می‌نویسد
+        conn = sqlite3.connect(self.db_path, timeout=COLLECTOR_DB_TIMEOUT)
+        while True:
+            item = self.batches.get()
+            if item is None:
+                break
+            key, seq, records, done, result = item
+            # batch تکراری (ACK قبلی گم شده یا دیر رسیده و agent دوباره فرستاده) فقط ACK
+            # می‌شود؛ چک و به‌روزرسانی last_seq فقط در همین thread انجام می‌شود
+            if seq <= self.last_seq.get(key, -1):
+                result[0] = True
+                done.set()
+                continue
+            try:
+                # نتایج upstream چک واقعی نیستند و فقط به GUI می‌روند
+                record_results(conn, [
+                    (ip, port, p_ok, s_ok, ov, format_ts(ts), latency)
+                    for ts, ip, port, p_ok, s_ok, ov, latency, upstream in records
+                    if not upstream
+                ])
+                self.last_seq[key] = seq
+                result[0] = True
+            except sqlite3.Error as e:
+                log.warning("collector: failed to store batch of %d results (%s)", len(records), e)
+                conn.rollback()
+            finally:
+                done.set()
+            if self.on_result and result[0]:
+                for ts, ip, port, p_ok, s_ok, ov, latency, upstream in records:
+                    self.on_result({
+                        "ip": ip, "port": port,
+                        "ping": bool(p_ok), "port_ok": bool(s_ok), "overall": ov,
+                        "latency": latency, "upstream": upstream
+                    })
+        conn.close()
+
+
+class CollectorWorker(QThread):
+    result_ready = pyqtSignal(dict)
+
+    def __init__(self, addr):
+        super().__init__()
+        self.collector = Collector(addr, DB_NAME, on_result=self.result_ready.emit)
+
+    def run(self):
+        self.collector.serve_forever()
+
+    def stop(self):
+        self.collector.shutdown()
+
+
+def parse_addr(text):
+    host, _, port = text.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+# =========================
+# GRID MODEL / SEARCH INDEX
+# =========================
+SLOW_MS = 200                      # بالاتر از این latency دستگاه «کند» است
+FLAP_WINDOW, FLAP_CHANGES = 10, 3  # تعداد تغییر وضعیت در چند نتیجه آخر = flapping
+
+
+def ip_to_int(ip):
+    if ip.count(".") != 3:
+        return None
+    try:
+        return int.from_bytes(socket.inet_aton(ip), "big")
+    except OSError:
+        return None
+
+
+class DeviceIndex:
+    """
+    ایندکس‌های از پیش ساخته روی یک snapshot: متن lowercase نام و IP برای جستجوی
+    substring و لیست مرتب IP ها برای فیلتر CIDR با bisect.
+    """
+    def __init__(self, snap):
+        self.size = len(snap)
+        self.text = [f"{d.name}\n{d.ip}".lower() for d in snap]
+        pairs = sorted((v, i) for i, d in enumerate(snap) if (v := ip_to_int(d.ip)) is not None)
+        self.ip_sorted = [v for v, _ in pairs]
+        self.ip_rows = [i for _, i in pairs]
+        self._last = ("", None)
+
+    def search(self, query):
+        query = query.lower()
+        last_query, last_rows = self._last
+        # هنگام تایپ، جستجوی جدید فقط روی نتیجه جستجوی قبلی انجام می‌شود
+        candidates = last_rows if last_query and last_query in query else range(self.size)
+        text = self.text
+        rows = [i for i in candidates if query in text[i]]
+        self._last = (query, rows)
+        return rows
+
+    def cidr(self, net):
+        lo = bisect.bisect_left(self.ip_sorted, int(net.network_address))
+        hi = bisect.bisect_right(self.ip_sorted, int(net.broadcast_address))
+        return sorted(self.ip_rows[lo:hi])
+
+
+class DeviceTableModel(QAbstractTableModel):
+    HEADERS = ["DEVICE NAME", "IP ADDRESS", "PORT", "PING", "SERVICE", "HEALTH STATUS"]
+    STATUS_FILTERS = ["All", "Offline", "Slow", "Flapping", "Upstream"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.snap = RegistrySnapshot(0, ())
+        self.search_index = DeviceIndex(self.snap)
+        self.status = {}    # key -> (ping, port_ok, overall, latency)
+        self.history = {}   # key -> آخرین نتایج overall برای تشخیص flapping
+        self.offline, self.slow, self.flapping = set(), set(), set()
+        self.upstream = set()  # دستگاه‌هایی که به خاطر قطعی upstream چک نشده‌اند
+        self.stale = {}     # key -> checked_at برای وضعیت‌های خوانده شده از device_state
+        self.checking = None
+        self.query = ""
+        self.status_filter = "All"
+        self.rows = []      # ایندکس snapshot برای هر سطر قابل مشاهده
+        self.pos = {}       # ایندکس snapshot -> سطر
+        # وقتی فیلتر وضعیت فعال است نتایج جدید با کمی تاخیر یکجا اعمال می‌شوند
+        self.refilter_timer = QTimer(self)
+        self.refilter_timer.setSingleShot(True)
+        self.refilter_timer.setInterval(300)
+        self.refilter_timer.timeout.connect(self.apply_filter)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def device_at(self, row):
+        return self.snap[self.rows[row]]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        d = self.device_at(index.row())
+        c = index.column()
+        st = self.status.get(d.key)
+        if role == Qt.DisplayRole:
+            if c == 0:
+                return d.name
+            if c == 1:
+                return d.ip
+            if c == 2:
+                return str(d.port)
+            if c == 5 and d.key == self.checking:
+                return "Checking..."
+            if st is None:
+                return "-"
+            if d.key in self.upstream:
+                return "UNREACHABLE (UPSTREAM)" if c == 5 else "-"
+            ping, port_ok, overall, latency = st
+            if c == 3:
+                return "SUCCESS" if ping else "FAILED"
+            if c == 4:
+                return f"OPEN ({latency:.0f} ms)" if port_ok and latency is not None else \
+                    "OPEN" if port_ok else "CLOSED"
+            txt = "ONLINE" if overall else "OFFLINE"
+            return f"{txt} (stale)" if d.key in self.stale else txt
+        if role == Qt.TextAlignmentRole and c != 1:
+            return Qt.AlignCenter
+        if role == Qt.ForegroundRole and c == 5:
+            if d.key == self.checking:
+                return QColor("#FFA500")
+            if d.key in self.upstream:
+                return QColor("#8B949E")
+            if st is not None and d.key in self.stale:
+                return QColor("#4F8A94") if st[2] else QColor("#9A4654")
+            if st is not None:
+                return QColor("#00F0FF") if st[2] else QColor("#FF4560")
+        if role == Qt.ToolTipRole and d.key in self.stale:
+            return f"Last checked {self.stale[d.key]}"
+        return None
+
+    def set_snapshot(self, snap):
+        keys = snap.index.keys()
+        self.snap = snap
+        self.search_index = DeviceIndex(snap)
+        for m in (self.status, self.history, self.stale):
+            for k in [k for k in m if k not in keys]:
+                del m[k]
+        for s in (self.offline, self.slow, self.flapping, self.upstream):
+            s.intersection_update(keys)
+        self.beginResetModel()
+        self.rows = self._match()
+        self.pos = {i: r for r, i in enumerate(self.rows)}
+        self.endResetModel()
+
+    def set_filter(self, query, status_filter):
+        self.query = query.strip()
+        self.status_filter = status_filter
+        self.apply_filter()
+
+    def apply_filter(self):
+        rows = self._match()
+        self.layoutAboutToBeChanged.emit()
+        old = self.persistentIndexList()
+        ids = [self.rows[i.row()] for i in old]
+        self.rows = rows
+        self.pos = {i: r for r, i in enumerate(rows)}
+        self.changePersistentIndexList(old, [
+            self.index(self.pos[s], i.column()) if s in self.pos else QModelIndex()
+            for s, i in zip(ids, old)
+        ])
+        self.layoutChanged.emit()
+
+    def _status_set(self):
+        return {"Offline": self.offline, "Slow": self.slow, "Flapping": self.flapping,
+                "Upstream": self.upstream}.get(self.status_filter)
+
+    def _match(self):
+        q = self.query
+        if "/" in q:
+            try:
+                rows = self.search_index.cidr(ipaddress.ip_network(q, strict=False))
+            except ValueError:
+                rows = []
+        elif q:
+            rows = self.search_index.search(q)
+        else:
+            rows = None
+        keys = self._status_set()
+        if keys is None:
+            return list(range(len(self.snap))) if rows is None else rows
+        allowed = {self.snap.index[k] for k in keys}
+        if rows is None:
+            return sorted(allowed)
+        return [i for i in rows if i in allowed]
+
+    def _row_changed(self, key):
+        r = self.pos.get(self.snap.find(*key), -1)
+        if r >= 0:
+            self.dataChanged.emit(self.index(r, 3), self.index(r, 5))
+
+    def set_checking(self, ip, port):
+        prev, self.checking = self.checking, (ip, port)
+        if prev:
+            self._row_changed(prev)
+        self._row_changed(self.checking)
+
+    def load_state(self, rows):
+        """وضعیت‌های ذخیره شده را به عنوان stale نمایش می‌دهد (فقط برای دستگاه‌های بدون نتیجه)."""
+        for ip, port, ping, port_ok, overall, latency, checked_at in rows:
+            key = (ip, port)
+            if key in self.status or self.snap.find(ip, port) < 0:
+                continue
+            self.status[key] = (bool(ping), bool(port_ok), overall, latency)
+            self.stale[key] = checked_at
+            self._update_sets(key, overall, latency, ())
+        self.apply_filter()
+
+    def _update_sets(self, key, overall, latency, hist):
+        for s, on in ((self.offline, not overall),
+                      (self.slow, latency is not None and latency > SLOW_MS),
+                      (self.flapping, sum(a != b for a, b in zip(hist, list(hist)[1:]))
+                       >= FLAP_CHANGES)):
+            if on:
+                s.add(key)
+            else:
+                s.discard(key)
+
+    def set_result(self, res):
+        key = (res['ip'], res['port'])
+        if self.snap.find(*key) < 0:
+            return
+        latency = res.get('latency')
+        self.status[key] = (res['ping'], res['port_ok'], res['overall'], latency)
+        self.stale.pop(key, None)
+        hist = self.history.setdefault(key, collections.deque(maxlen=FLAP_WINDOW))
+        hist.append(res['overall'])
+
+        keys = self._status_set()
+        before = keys is not None and key in keys
+        self._update_sets(key, res['overall'], latency, hist)
+        if res.get('upstream'):
+            self.upstream.add(key)
+        else:
+            self.upstream.discard(key)
+        if self.checking == key:
+            self.checking = None
+        if keys is not None and before != (key in keys) and not self.refilter_timer.isActive():
+            self.refilter_timer.start()
+        self._row_changed(key)
+
+
+# =========================
+# SLA SUMMARIES / REPORTS
+# =========================
+SUMMARY_CHUNK = 200_000   # رکورد لاگ در هر تراکنش؛ کوچک تا قفل نوشتن طولانی نشود
+SUMMARY_TAIL_MAX = 2 * SUMMARY_CHUNK   # گزارش حداکثر این تعداد لاگ خلاصه نشده را خام می‌خواند
+TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def ensure_log_indexes(conn, on_start=None):
+    """
+    ایندکس‌های device_logs؛ روی دیتابیس بزرگ ساختن آن‌ها چند دقیقه طول می‌کشد، پس فقط
+    از SummaryWorker (نه هنگام اجرای برنامه) صدا زده می‌شود.
+    """
+    existing = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='device_logs'"
+    )}
+    missing = [
+        (name, sql) for name, sql in (
+            ("idx_device_logs_dev_ts",
+             "CREATE INDEX idx_device_logs_dev_ts ON device_logs (ip, port, timestamp)"),
+            ("idx_device_logs_ts", "CREATE INDEX idx_device_logs_ts ON device_logs (timestamp)"),
+        ) if name not in existing
+    ]
+    if missing and on_start:
+        on_start()
+    for name, sql in missing:
+        conn.execute(sql)
+        conn.commit()
+    return bool(missing)
+
+
+def init_summary_schema(conn):
+    # تعداد نمونه و نمونه‌های آنلاین هر دستگاه در هر روز
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS device_daily ("
+        "ip TEXT, port INTEGER, day TEXT, samples INTEGER, up_samples INTEGER, "
+        "PRIMARY KEY (ip, port, day))"
+    )
+    # هر قطعی: از اولین نمونه OFFLINE تا اولین نمونه ONLINE بعدی؛ قطعی جاری end ندارد
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS device_outages ("
+        "ip TEXT, port INTEGER, start TEXT, end TEXT, PRIMARY KEY (ip, port, start))"
+    )
+    # rollup ساعتی برای نمودار
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS device_hourly ("
+        "ip TEXT, port INTEGER, hour TEXT, samples INTEGER, up_samples INTEGER, "
+        "lat_min REAL, lat_max REAL, lat_sum REAL, lat_n INTEGER, "
+        "PRIMARY KEY (ip, port, hour))"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS sla_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.commit()
+
+
+def summary_watermark(conn):
+    """(آخرین rowid خلاصه شده, بیشترین rowid لاگ)"""
+    row = conn.execute("SELECT value FROM sla_meta WHERE key='log_rowid'").fetchone()
+    top = conn.execute("SELECT MAX(rowid) FROM device_logs").fetchone()[0] or 0
+    return (row[0] if row else 0), top
+
+
+def refresh_summaries(conn):
+    """
+    لاگ‌های جدید (rowid بیشتر از watermark) را به device_daily و device_outages اضافه
+    می‌کند. هر مرحله در یک تراکنش همراه با watermark ثبت می‌شود، پس اجرای همزمان یا
+    نیمه‌کاره باعث شمارش دوباره نمی‌شود.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM sla_meta WHERE key='log_rowid'").fetchone()
+            last = row[0] if row else 0
+            top = conn.execute("SELECT MAX(rowid) FROM device_logs").fetchone()[0] or 0
+            if top <= last:
+                conn.rollback()
+                return
+            hi = min(top, last + SUMMARY_CHUNK)
+            _summarize_chunk(conn, last, hi)
+            conn.execute("INSERT OR REPLACE INTO sla_meta VALUES ('log_rowid', ?)", (hi,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _summarize_chunk(conn, lo, hi):
+    conn.execute(
+        "INSERT INTO device_daily (ip, port, day, samples, up_samples) "
+        "SELECT ip, port, substr(timestamp, 1, 10), COUNT(*), SUM(overall) "
+        "FROM device_logs WHERE rowid > ? AND rowid <= ? "
+        "GROUP BY ip, port, substr(timestamp, 1, 10) "
+        "ON CONFLICT (ip, port, day) DO UPDATE SET "
+        "samples = samples + excluded.samples, up_samples = up_samples + excluded.up_samples",
+        (lo, hi)
+    )
+    conn.execute(
+        "INSERT INTO device_hourly "
+        "(ip, port, hour, samples, up_samples, lat_min, lat_max, lat_sum, lat_n) "
+        "SELECT ip, port, substr(timestamp, 1, 13), COUNT(*), SUM(overall), "
+        "MIN(latency), MAX(latency), TOTAL(latency), COUNT(latency) "
+        "FROM device_logs WHERE rowid > ? AND rowid <= ? "
+        "GROUP BY ip, port, substr(timestamp, 1, 13) "
+        "ON CONFLICT (ip, port, hour) DO UPDATE SET "
+        "samples = samples + excluded.samples, up_samples = up_samples + excluded.up_samples, "
+        "lat_min = MIN(COALESCE(lat_min, excluded.lat_min), COALESCE(excluded.lat_min, lat_min)), "
+        "lat_max = MAX(COALESCE(lat_max, excluded.lat_max), COALESCE(excluded.lat_max, lat_max)), "
+        "lat_sum = lat_sum + excluded.lat_sum, lat_n = lat_n + excluded.lat_n",
+        (lo, hi)
+    )
+
+    closes, starts = _outage_transitions(conn, "rowid > ? AND rowid <= ?", (lo, hi))
+    if closes is None:
+        return
+    conn.executemany(
+        "UPDATE device_outages SET end=? WHERE ip=? AND port=? AND end IS NULL",
+        closes[["timestamp", "ip", "port"]].itertuples(index=False, name=None)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO device_outages (ip, port, start, end) VALUES (?,?,?,?)",
+        [(ip, int(port), ts, None if pd.isna(end) else end)
+         for ip, port, ts, end in starts[["ip", "port", "timestamp", "next_ts"]]
+         .itertuples(index=False, name=None)]
+    )
+
+
+def _outage_transitions(conn, where, params):
+    """
+    تغییر وضعیت‌های لاگ‌های انتخاب شده با `where`، به ترتیب rowid هر دستگاه.
+    closes: (ip, port, timestamp) که قطعی باز قبلی را می‌بندد؛
+    starts: (ip, port, timestamp, next_ts) قطعی‌های جدید (next_ts برای قطعی هنوز باز NaN).
+    """
+    df = pd.read_sql_query(
+        f"SELECT ip, port, overall, timestamp FROM device_logs WHERE {where} "
+        "ORDER BY ip, port, rowid",
+        conn, params=params
+    )
+    if df.empty:
+        return None, None
+    open_ = pd.read_sql_query(
+        "SELECT ip, port, 0 AS was FROM device_outages WHERE end IS NULL", conn
+    )
+    df = df.merge(open_, on=["ip", "port"], how="left")
+    # وضعیت قبلی هر نمونه؛ برای اولین نمونه هر دستگاه از قطعی باز قبلی می‌آید
+    prev = df.groupby(["ip", "port"], sort=False)["overall"].shift()
+    prev = prev.fillna(df["was"].fillna(1))
+    trans = df.loc[df["overall"] != prev, ["ip", "port", "overall", "timestamp"]]
+    if trans.empty:
+        return None, None
+    g = trans.groupby(["ip", "port"], sort=False)
+    trans = trans.assign(
+        first=g.cumcount() == 0,
+        next_ts=g["timestamp"].shift(-1),
+    )
+    closes = trans[(trans["overall"] == 1) & trans["first"]]
+    starts = trans[trans["overall"] == 0]
+    return closes, starts
+
+
+def _full_day_span(f, t):
+    """روزهای کامل داخل بازه [f, t] (یا None) که از device_daily خوانده می‌شوند."""
+    f_dt, t_dt = datetime.strptime(f, TS_FMT), datetime.strptime(t, TS_FMT)
+    first = f_dt.date() if f_dt.strftime("%H:%M:%S") == "00:00:00" else \
+        (f_dt + timedelta(days=1)).date()
+    last = t_dt.date() if t_dt.strftime("%H:%M:%S") == "23:59:59" else \
+        (t_dt - timedelta(days=1)).date()
+    if first > last:
+        return None
+    return first.isoformat(), last.isoformat()
+
+
+def sla_report(conn, f, t, by="device"):
+    """
+    دسترس‌پذیری (بر اساس زمان قطعی)، تعداد قطعی، MTTR و طولانی‌ترین قطعی در بازه [f, t]
+    برای هر دستگاه یا هر سایت (agent). خلاصه‌ها تا watermark خوانده می‌شوند و لاگ‌های
+    بعد از آن (حداکثر SUMMARY_TAIL_MAX، توسط SummaryWorker خلاصه می‌شوند) خام.
+    """
+    last, _ = summary_watermark(conn)
+    span = _full_day_span(f, t)
+    if span:
+        d0, d1 = span
+        # +timestamp: برای لاگ‌های خلاصه نشده اسکن بر اساس rowid، نه ایندکس زمان
+        counts_sql = (
+            "SELECT ip, port, SUM(samples) AS samples FROM ("
+            " SELECT ip, port, samples FROM device_daily WHERE day BETWEEN ? AND ?"
+            " UNION ALL"
+            " SELECT ip, port, COUNT(*) FROM device_logs"
+            "  WHERE rowid > ? AND +timestamp BETWEEN ? AND ? GROUP BY ip, port"
+            " UNION ALL"
+            " SELECT ip, port, COUNT(*) FROM device_logs"
+            "  WHERE timestamp >= ? AND timestamp < ? GROUP BY ip, port"
+            " UNION ALL"
+            " SELECT ip, port, COUNT(*) FROM device_logs"
+            "  WHERE timestamp > ? AND timestamp <= ? GROUP BY ip, port"
+            ") GROUP BY ip, port"
+        )
+        params = (d0, d1, last, d0 + " 00:00:00", d1 + " 23:59:59",
+                  f, d0 + " 00:00:00", d1 + " 23:59:59", t)
+    else:
+        counts_sql = (
+            "SELECT ip, port, COUNT(*) AS samples FROM device_logs "
+            "WHERE timestamp BETWEEN ? AND ? GROUP BY ip, port"
+        )
+        params = (f, t)
+    counts = pd.read_sql_query(counts_sql, conn, params=params)
+    outages = _report_outages(conn, f, t, last)
+
+    now = datetime.now().strftime(TS_FMT)
+    range_secs = (pd.Timestamp(min(t, now)) - pd.Timestamp(f)).total_seconds()
+    start, end = outages["start"], outages["end"].fillna(now)
+    s = pd.to_datetime(start.where(start > f, f))
+    e = pd.to_datetime(end.where(end < t, t))
+    outages["secs"] = (e - s).dt.total_seconds().clip(lower=0)
+    resolved = outages["end"].notna() & (outages["end"] <= t)
+    outages["fixed_secs"] = outages["secs"].where(resolved, 0.0)
+    outages["fixed"] = resolved.astype(int)
+
+    devices = pd.read_sql_query("SELECT name, ip, port, agent FROM devices", conn)
+    devices["site"] = devices["agent"].fillna("").replace("", "local")
+    devices = devices.drop_duplicates(["ip", "port"])
+
+    # یک سطر برای هر دستگاهی که در بازه نمونه یا قطعی دارد
+    dev = counts.set_index(["ip", "port"]).join(
+        outages.groupby(["ip", "port"]).agg(
+            outages=("secs", "size"), down=("secs", "sum"), longest=("secs", "max"),
+            fixed_secs=("fixed_secs", "sum"), fixed=("fixed", "sum"),
+        ), how="outer"
+    ).reset_index()
+    dev[["samples", "outages", "down", "fixed_secs", "fixed"]] = \
+        dev[["samples", "outages", "down", "fixed_secs", "fixed"]].fillna(0)
+    dev = dev.merge(devices, on=["ip", "port"], how="inner")
+    dev["devices"] = 1
+
+    if by == "device":
+        rep = dev
+    else:
+        rep = dev.groupby("site").agg(
+            devices=("devices", "sum"), samples=("samples", "sum"), outages=("outages", "sum"),
+            down=("down", "sum"), longest=("longest", "max"),
+            fixed_secs=("fixed_secs", "sum"), fixed=("fixed", "sum"),
+        ).reset_index()
+    rep["samples"] = rep["samples"].astype(int)
+    rep["outages"] = rep["outages"].astype(int)
+    if range_secs > 0:
+        avail = 100 * (1 - rep["down"] / (range_secs * rep["devices"]))
+        rep["availability"] = avail.clip(0, 100).round(3)
+    else:
+        rep["availability"] = float("nan")
+    rep["mttr"] = (rep["fixed_secs"] / rep["fixed"].where(rep["fixed"] > 0) / 60).round(1)
+    rep["longest"] = (rep["longest"] / 60).round(1)
+
+    if by == "device":
+        cols = {"name": "Device", "ip": "IP", "port": "Port", "site": "Site"}
+    else:
+        cols = {"site": "Site", "devices": "Devices"}
+    cols.update({
+        "availability": "Availability %", "outages": "Outages",
+        "mttr": "MTTR (min)", "longest": "Longest Outage (min)", "samples": "Samples",
+    })
+    return rep[list(cols)].rename(columns=cols).sort_values("Availability %")
+
+
+def _report_outages(conn, f, t, last):
+    """قطعی‌های هم‌پوشان با [f, t]: device_outages به‌علاوه تغییرات لاگ‌های بعد از watermark."""
+    outages = pd.read_sql_query(
+        "SELECT ip, port, start, end FROM device_outages "
+        "WHERE start <= ? AND (end IS NULL OR end >= ?)",
+        conn, params=(t, f)
+    )
+    closes, starts = _outage_transitions(conn, "rowid > ?", (last,))
+    if closes is None:
+        return outages
+    # قطعی‌های باز ممکن است قبل از f شروع شده باشند، پس جداگانه خوانده می‌شوند
+    open_ = pd.read_sql_query(
+        "SELECT ip, port, start, end FROM device_outages WHERE end IS NULL AND start <= ?",
+        conn, params=(t,)
+    )
+    open_ = open_.merge(closes[["ip", "port", "timestamp"]], on=["ip", "port"], how="left")
+    open_["end"] = open_["timestamp"]
+    new = starts[["ip", "port", "timestamp", "next_ts"]].rename(
+        columns={"timestamp": "start", "next_ts": "end"}
+    )
+    outages = pd.concat([
+        outages[outages["end"].notna()], open_[["ip", "port", "start", "end"]], new
+    ], ignore_index=True)
+    keep = (outages["start"] <= t) & (outages["end"].isna() | (outages["end"] >= f))
+    return outages[keep].reset_index(drop=True)
+
+
+def ts_to_epoch(text):
+    # زمان‌های لاگ محلی و بدون منطقه زمانی هستند؛ مثل strftime('%s') در SQLite با آن‌ها
+    # به صورت UTC رفتار می‌شود تا محاسبه سطل‌ها در پایتون و SQL یکسان باشد
+    return calendar.timegm(time.strptime(text, TS_FMT))
+
+
+def epoch_to_ts(sec):
+    return time.strftime(TS_FMT, time.gmtime(sec))
+
+
+def timeline(conn, ip, port, f, t, buckets):
+    """
+    داده نمودار بازه [f, t] (ثانیه) در حداکثر `buckets` سطل: برای هر سطل تعداد نمونه،
+    نمونه‌های آنلاین و min/max/avg تاخیر. سطل‌های یک ساعته یا بزرگ‌تر از device_hourly
+    (تا watermark) به‌علاوه لاگ‌های خلاصه نشده خوانده می‌شوند.
+    خروجی: (عرض سطل, [(شروع, n, up, lat_min, lat_max, lat_avg), ...])
+    """
+    width = max(1, -(-(t - f) // max(1, buckets)))
+    last, top = summary_watermark(conn)
+    if width >= 3600 and top - last <= SUMMARY_TAIL_MAX:
+        h0, h1 = epoch_to_ts(f)[:13], epoch_to_ts(t)[:13]
+        # لاگ‌های بعد از watermark با شروع ساعتشان در سطل قرار می‌گیرند، مثل device_hourly؛
+        # +ip/+port/+timestamp: اسکن بر اساس rowid، نه ایندکس
+        rows = conn.execute(
+            "SELECT b, SUM(n), SUM(up), MIN(lo), MAX(hi), SUM(s) / SUM(ln) FROM ("
+            " SELECT (strftime('%s', hour || ':00:00') - ?) / ? AS b, samples AS n, "
+            "  up_samples AS up, lat_min AS lo, lat_max AS hi, lat_sum AS s, lat_n AS ln "
+            "  FROM device_hourly WHERE ip=? AND port=? AND hour BETWEEN ? AND ?"
+            " UNION ALL"
+            " SELECT (strftime('%s', substr(timestamp, 1, 13) || ':00:00') - ?) / ?, 1, "
+            "  overall, latency, latency, latency, latency IS NOT NULL "
+            "  FROM device_logs WHERE rowid > ? AND +ip=? AND +port=? "
+            "  AND +timestamp BETWEEN ? AND ?"
+            ") GROUP BY b ORDER BY b",
+            (f, width, ip, port, h0, h1,
+             f, width, last, ip, port, h0 + ":00:00", h1 + ":59:59")
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT (strftime('%s', timestamp) - ?) / ? AS b, COUNT(*), SUM(overall), "
+            "MIN(latency), MAX(latency), AVG(latency) "
+            "FROM device_logs WHERE ip=? AND port=? AND timestamp BETWEEN ? AND ? "
+            "GROUP BY b ORDER BY b",
+            (f, width, ip, port, epoch_to_ts(f), epoch_to_ts(t))
+        ).fetchall()
+    return width, [(f + b * width, n, up, lo, hi, avg) for b, n, up, lo, hi, avg in rows]
+
+
+class SummaryWorker(QThread):
+    status = pyqtSignal(str)
+
+    def run(self):
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        try:
+            if ensure_log_indexes(conn, lambda: self.status.emit("Building log indexes...")):
+                self.status.emit("Building SLA summaries...")
+            refresh_summaries(conn)
+        except sqlite3.Error as e:
+            # دفعه بعد تایمر دوباره تلاش می‌کند
+            log.warning("summary refresh failed: %s", e)
+        finally:
+            conn.close()
+            self.status.emit("")
+
+
+class DataFrameModel(QAbstractTableModel):
+    def __init__(self, df=None, parent=None):
+        super().__init__(parent)
+        self.df = df if df is not None else pd.DataFrame()
+
+    def set_frame(self, df):
+        self.beginResetModel()
+        self.df = df
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.df)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.df.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return str(self.df.columns[section])
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            val = self.df.iat[index.row(), index.column()]
+            return "-" if pd.isna(val) else str(val)
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
 
 
 # =========================
 # MAIN WINDOW
 # =========================
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, listen=None):
         super().__init__()
-        self.devices = []
+        self.registry = DeviceRegistry()
+        self.registry.subscribe(self.on_registry_changed)
         self.init_db()
         self.setup_ui()
         self.load_from_db()
+        self.load_last_state()
 
         # تایمر برای سینک خودکار از SQL Server
         self.sql_timer = QTimer(self)
@@ -495,23 +1993,57 @@ class MainWindow(QWidget):
         # اگر نخواستی از ابتدا فعال باشد، می‌توانی بعد از تعریف پروفایل‌ها start کنی
         self.sql_timer.start()
 
-        self.worker = SerialWorker(self.devices, self.get_interval, self.get_ping_count)
+        self.worker = SerialWorker(self.registry, self.get_interval, self.get_ping_count)
         self.worker.checking_now.connect(self.mark_row_checking)
         self.worker.result_ready.connect(self.update_row)
         self.worker.tick.connect(self.update_progress)
         self.worker.start()
 
+        # به‌روزرسانی تدریجی جداول خلاصه SLA در پس‌زمینه
+        self.summary_worker = SummaryWorker()
+        self.summary_worker.status.connect(self.summary_lbl.setText)
+        self.summary_timer = QTimer(self)
+        self.summary_timer.setInterval(300_000)  # هر ۵ دقیقه
+        self.summary_timer.timeout.connect(self.refresh_summaries)
+        self.summary_timer.start()
+        self.refresh_summaries()
+
+        # دریافت نتایج agent های راه دور (در صورت اجرا با --listen)
+        self.collector = None
+        if listen:
+            self.collector = CollectorWorker(listen)
+            self.collector.result_ready.connect(self.update_row)
+            self.collector.start()
+
     def init_db(self):
         conn = sqlite3.connect(DB_NAME)
-        conn.execute("CREATE TABLE IF NOT EXISTS devices (name TEXT, ip TEXT, port INTEGER)")
-        conn.execute(
-            "CREATE TABLE IF NOT EXISTS device_logs ("
-            "ip TEXT, port INTEGER, ping INTEGER, port_status INTEGER, "
-            "overall INTEGER, timestamp TEXT)"
-        )
-        conn.commit()
+        init_schema(conn)
         conn.close()
 
+    def write_db(self, statements, notify=True):
+        """
+        statements: [(sql, params)] در یک تراکنش. اگر دیتابیس قفل باشد (مثلاً هنگام ساخت
+        ایندکس‌ها) تغییرات ذخیره نمی‌شوند و False برمی‌گردد.
+        """
+        conn = sqlite3.connect(DB_NAME)
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+            conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            log.warning("database write failed: %s", e)
+            if notify:
+                QMessageBox.warning(
+                    self, "Database Busy",
+                    f"Changes were not saved, the database is busy:\n{str(e)}\n"
+                    "Please try again in a moment."
+                )
+            return False
+        finally:
+            conn.close()
+
     def open_context_menu(self, pos):
         row = self.table.rowAt(pos.y())
         if row < 0:
@@ -559,6 +2091,9 @@ class MainWindow(QWidget):
         btn_del = QPushButton("Delete Selected")
         btn_del.clicked.connect(self.delete_selected)
 
+        btn_sla = QPushButton("SLA Report")
+        btn_sla.clicked.connect(self.open_sla_report)
+
         tools.addWidget(QLabel("Interval (s):"))
         tools.addWidget(self.interval_spin)
         tools.addWidget(QLabel("Pings:"))
@@ -567,22 +2102,40 @@ class MainWindow(QWidget):
         tools.addWidget(btn_add)
         tools.addWidget(btn_excel)
         tools.addWidget(btn_sql_profiles)
+        tools.addWidget(btn_sla)
         tools.addWidget(btn_del)
 
         main_layout.addLayout(tools)
 
-        self.table = QTableWidget(0, 6)
-        self.table.setHorizontalHeaderLabels([
-            "DEVICE NAME", "IP ADDRESS", "PORT",
-            "PING", "SERVICE", "HEALTH STATUS"
-        ])
+        filter_bar = QHBoxLayout()
+        self.search_in = QLineEdit()
+        self.search_in.setPlaceholderText("Search name / IP, or CIDR (e.g. 10.0.0.0/24)")
+        self.search_in.setClearButtonEnabled(True)
+        self.search_in.textChanged.connect(self.apply_filter)
+        self.status_filter = QComboBox()
+        self.status_filter.addItems(DeviceTableModel.STATUS_FILTERS)
+        self.status_filter.currentTextChanged.connect(self.apply_filter)
+        self.count_lbl = QLabel()
+        self.count_lbl.setStyleSheet("color:#8B949E;")
+        filter_bar.addWidget(self.search_in)
+        filter_bar.addWidget(QLabel("Show:"))
+        filter_bar.addWidget(self.status_filter)
+        filter_bar.addWidget(self.count_lbl)
+        main_layout.addLayout(filter_bar)
+
+        self.model = DeviceTableModel(self)
+        self.model.layoutChanged.connect(self.update_count)
+        self.model.modelReset.connect(self.update_count)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.setAlternatingRowColors(True)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.open_context_menu)
-        self.table.cellDoubleClicked.connect(self.open_device_logs)
+        self.table.doubleClicked.connect(self.open_device_logs)
         self.table.viewport().installEventFilter(self)
 
         main_layout.addWidget(self.table)
@@ -590,67 +2143,52 @@ class MainWindow(QWidget):
         footer = QHBoxLayout()
         self.progress = QProgressBar()
         self.status_lbl = QLabel("Monitoring Engine Ready")
+        self.summary_lbl = QLabel("")
         footer.addWidget(self.status_lbl)
+        footer.addWidget(self.summary_lbl)
         footer.addWidget(self.progress)
         main_layout.addLayout(footer)
 
     def eventFilter(self, source, event):
         if event.type() == event.MouseButtonRelease and event.button() == Qt.MidButton:
-            item = self.table.itemAt(event.pos())
-            if item:
-                webbrowser.open(f"http://{self.table.item(item.row(), 1).text()}")
+            index = self.table.indexAt(event.pos())
+            if index.isValid():
+                webbrowser.open(f"http://{self.model.device_at(index.row()).ip}")
         return super().eventFilter(source, event)
 
-    def open_device_logs(self, row, col):
-        name = self.table.item(row, 0).text()
-        ip = self.table.item(row, 1).text()
-        port = int(self.table.item(row, 2).text())
-        LogWindow(ip, port, name).exec_()
+    def open_device_logs(self, index):
+        d = self.model.device_at(index.row())
+        LogWindow(d.ip, d.port, d.name).exec_()
 
     def load_from_db(self):
         conn = sqlite3.connect(DB_NAME)
-        rows = conn.execute("SELECT name, ip, port FROM devices").fetchall()
+        rows = conn.execute("SELECT name, ip, port, agent, parent FROM devices").fetchall()
         conn.close()
-        self.devices[:] = [{"name": r[0], "ip": r[1], "port": r[2]} for r in rows]
+        self.registry.replace([Device(*r) for r in rows])
+
+    def load_last_state(self):
+        conn = sqlite3.connect(DB_NAME)
+        rows = load_device_state(conn)
+        conn.close()
+        self.model.load_state(rows)
+
+    def on_registry_changed(self, generation, changes):
         self.refresh_table_ui()
 
     def refresh_table_ui(self):
-        self.table.setRowCount(len(self.devices))
-        for r, d in enumerate(self.devices):
-            it_name = QTableWidgetItem(d['name'])
-            it_name.setTextAlignment(Qt.AlignCenter)
-            self.table.setItem(r, 0, it_name)
-            self.table.setItem(r, 1, QTableWidgetItem(d['ip']))
-            for c in range(2, 6):
-                it = QTableWidgetItem(str(d['port']) if c == 2 else "-")
-                it.setTextAlignment(Qt.AlignCenter)
-                self.table.setItem(r, c, it)
+        self.model.set_snapshot(self.registry.snapshot())
+
+    def apply_filter(self):
+        self.model.set_filter(self.search_in.text(), self.status_filter.currentText())
+
+    def update_count(self):
+        self.count_lbl.setText(f"{self.model.rowCount()} / {len(self.model.snap)} devices")
 
     def mark_row_checking(self, ip, port):
-        for r in range(self.table.rowCount()):
-            if (self.table.item(r, 1).text() == ip and
-                    self.table.item(r, 2).text() == str(port)):
-                it = QTableWidgetItem("Checking...")
-                it.setTextAlignment(Qt.AlignCenter)
-                it.setForeground(QColor("#FFA500"))
-                self.table.setItem(r, 5, it)
-                break
+        self.model.set_checking(ip, port)
 
     def update_row(self, res):
-        for r in range(self.table.rowCount()):
-            if (self.table.item(r, 1).text() == res['ip'] and
-                    self.table.item(r, 2).text() == str(res['port'])):
-                data = {
-                    3: "SUCCESS" if res['ping'] else "FAILED",
-                    4: "OPEN" if res['port_ok'] else "CLOSED",
-                    5: "ONLINE" if res['overall'] else "OFFLINE"
-                }
-                for c, txt in data.items():
-                    it = QTableWidgetItem(txt)
-                    it.setTextAlignment(Qt.AlignCenter)
-                    if c == 5:
-                        it.setForeground(QColor("#00F0FF") if res['overall'] else QColor("#FF4560"))
-                    self.table.setItem(r, c, it)
+        self.model.set_result(res)
 
     def add_manual(self):
         dlg = AddDeviceDialog(self)
@@ -658,11 +2196,10 @@ class MainWindow(QWidget):
             n = dlg.name_in.text().strip()
             i = dlg.ip_in.text().strip()
             p = dlg.port_in.value()
-            if n and i:
-                conn = sqlite3.connect(DB_NAME)
-                conn.execute("INSERT INTO devices VALUES (?,?,?)", (n, i, p))
-                conn.commit()
-                conn.close()
+            parent = dlg.parent_in.text().strip() or None
+            if n and i and self.write_db([(
+                "INSERT INTO devices (name, ip, port, parent) VALUES (?,?,?,?)", (n, i, p, parent)
+            )]):
                 self.load_from_db()
 
     def import_excel(self):
@@ -670,11 +2207,15 @@ class MainWindow(QWidget):
         if path:
             try:
                 df = pd.read_excel(path)
+                has_agent = 'agent' in df.columns
+                has_parent = 'parent' in df.columns
                 conn = sqlite3.connect(DB_NAME)
                 for _, r in df.iterrows():
+                    agent = str(r['agent']) if has_agent and pd.notna(r['agent']) else None
+                    parent = str(r['parent']) if has_parent and pd.notna(r['parent']) else None
                     conn.execute(
-                        "INSERT INTO devices VALUES (?,?,?)",
-                        (str(r['name']), str(r['ip']), int(r['port']))
+                        "INSERT INTO devices (name, ip, port, agent, parent) VALUES (?,?,?,?,?)",
+                        (str(r['name']), str(r['ip']), int(r['port']), agent, parent)
                     )
                 conn.commit()
                 conn.close()
@@ -683,6 +2224,13 @@ class MainWindow(QWidget):
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to import Excel:\n{str(e)}")
 
+    def open_sla_report(self):
+        SlaReportDialog(self).exec_()
+
+    def refresh_summaries(self):
+        if not self.summary_worker.isRunning():
+            self.summary_worker.start()
+
     def open_sync_profiles(self):
         if not HAS_ODBC:
             QMessageBox.critical(
@@ -731,6 +2279,8 @@ class MainWindow(QWidget):
                     name = getattr(row, 'name', None) or row[0]
                     ip = getattr(row, 'ip', None) or row[1]
                     port = getattr(row, 'port', None) or row[2]
+                    agent = getattr(row, 'agent', None)
+                    parent = getattr(row, 'parent', None)
                 except Exception:
                     continue
                 if not ip:
@@ -738,38 +2288,31 @@ class MainWindow(QWidget):
                 all_devices.append({
                     "name": str(name) if name else "Unknown",
                     "ip": str(ip),
-                    "port": int(port) if port else 80
+                    "port": int(port) if port else 80,
+                    "agent": str(agent) if agent else None,
+                    "parent": str(parent) if parent else None
                 })
 
         if not all_devices:
             return
 
-        conn = sqlite3.connect(DB_NAME)
-        conn.execute("DELETE FROM devices")
-        for d in all_devices:
-            conn.execute(
-                "INSERT INTO devices VALUES (?,?,?)",
-                (d['name'], d['ip'], d['port'])
-            )
-        conn.commit()
-        conn.close()
-        self.load_from_db()
+        # سینک خودکار است؛ اگر دیتابیس قفل بود دور بعد تایمر دوباره تلاش می‌کند
+        if self.write_db([("DELETE FROM devices", ())] + [(
+            "INSERT INTO devices (name, ip, port, agent, parent) VALUES (?,?,?,?,?)",
+            (d['name'], d['ip'], d['port'], d['agent'], d['parent'])
+        ) for d in all_devices], notify=False):
+            self.load_from_db()
 
     def delete_selected(self):
         rows = sorted({i.row() for i in self.table.selectedIndexes()}, reverse=True)
         if rows and QMessageBox.question(
             self, "Confirm", f"Delete {len(rows)} devices?", QMessageBox.Yes | QMessageBox.No
         ) == QMessageBox.Yes:
-            conn = sqlite3.connect(DB_NAME)
-            for r in rows:
-                conn.execute(
-                    "DELETE FROM devices WHERE ip=? AND port=?",
-                    (self.table.item(r, 1).text(),
-                     int(self.table.item(r, 2).text()))
-                )
-            conn.commit()
-            conn.close()
-            self.load_from_db()
+            devices = [self.model.device_at(r) for r in rows]
+            if self.write_db([
+                ("DELETE FROM devices WHERE ip=? AND port=?", (d.ip, d.port)) for d in devices
+            ]):
+                self.load_from_db()
 
     def update_progress(self, rem, total):
         self.progress.setValue(int((rem / total) * 100))
@@ -782,33 +2325,71 @@ class MainWindow(QWidget):
         return self.ping_spin.value()
 
     def edit_device(self, row):
-        old_name = self.table.item(row, 0).text()
-        old_ip = self.table.item(row, 1).text()
-        old_port = int(self.table.item(row, 2).text())
+        d = self.model.device_at(row)
+        old_name, old_ip, old_port = d.name, d.ip, d.port
 
         dlg = AddDeviceDialog(self)
         dlg.name_in.setText(old_name)
         dlg.ip_in.setText(old_ip)
         dlg.port_in.setValue(old_port)
+        dlg.parent_in.setText(d.parent or "")
 
         if dlg.exec_():
             new_name = dlg.name_in.text().strip()
             new_ip = dlg.ip_in.text().strip()
             new_port = dlg.port_in.value()
+            new_parent = dlg.parent_in.text().strip() or None
             if not new_name or not new_ip:
                 return
-            conn = sqlite3.connect(DB_NAME)
-            conn.execute(
-                "UPDATE devices SET name=?, ip=?, port=? WHERE ip=? AND port=?",
-                (new_name, new_ip, new_port, old_ip, old_port)
-            )
-            conn.commit()
-            conn.close()
-            self.load_from_db()
+            if self.write_db([(
+                "UPDATE devices SET name=?, ip=?, port=?, parent=? WHERE ip=? AND port=?",
+                (new_name, new_ip, new_port, new_parent, old_ip, old_port)
+            )]):
+                self.load_from_db()
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    w = MainWindow()
+    parser = argparse.ArgumentParser(description="Device Monitor")
+    parser.add_argument("--agent", metavar="ID",
+                        help="run headless probe agent for devices assigned to ID")
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="collector address used by --agent")
+    parser.add_argument("--collector", action="store_true",
+                        help="run headless collector (requires --listen)")
+    parser.add_argument("--listen", metavar="HOST:PORT",
+                        help="accept agent results on this address")
+    parser.add_argument("--interval", type=int, default=10, help="agent sweep interval (s)")
+    parser.add_argument("--pings", type=int, default=1, help="agent ping count")
+    parser.add_argument("--db", default=DB_NAME, help="sqlite database file")
+    args, qt_args = parser.parse_known_args()
+    DB_NAME = args.db
+
+    if args.agent:
+        if not args.connect:
+            parser.error("--agent requires --connect HOST:PORT")
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        agent = ProbeAgent(args.agent, parse_addr(args.connect), args.interval, args.pings)
+        try:
+            agent.run()
+        except KeyboardInterrupt:
+            agent.stop()
+        sys.exit(0)
+
+    if args.collector:
+        if not args.listen:
+            parser.error("--collector requires --listen HOST:PORT")
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        conn = sqlite3.connect(DB_NAME)
+        init_schema(conn)
+        conn.close()
+        collector = Collector(parse_addr(args.listen), DB_NAME)
+        try:
+            collector.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    w = MainWindow(listen=parse_addr(args.listen) if args.listen else None)
     w.show()
     sys.exit(app.exec_())